@@ -0,0 +1,88 @@
+from datetime import datetime
+from htm.bindings.sdr import SDR
+from htmapp.config import hotgym_parameters
+from htmapp.models.hotgym import Model
+import argparse
+import csv
+import os
+import time
+
+_EXAMPLE_DIR = os.path.dirname(os.path.abspath(__file__))
+_INPUT_FILE_PATH = os.path.join(_EXAMPLE_DIR, "gymdata.csv")
+
+
+def parse_args(argv):
+    parser = argparse.ArgumentParser(description='Hotgym run benchmark.',
+                                     prog=__name__)
+    parser.add_argument('-n',
+                        '--records',
+                        dest='records',
+                        default=2000,
+                        type=int,
+                        help='records per run. default is 2000')
+    args = parser.parse_args(argv)
+    return args
+
+
+class Parameters(object):
+    def get_parameters(self):
+        return hotgym_parameters
+
+
+# the run path before the buffers were preallocated
+def allocating_run(self, timestamp=None, consumption=None):
+    dateBits = self.dateEncoder.encode(datetime.fromtimestamp(timestamp))
+    consumptionBits = self.scalarEncoder.encode(consumption)
+    encoding = SDR(self.encodingWidth).concatenate(
+        [consumptionBits, dateBits])
+    activeColumns = SDR(self.sp.getColumnDimensions())
+    self.sp.compute(encoding, True, activeColumns)
+    self.tm.compute(activeColumns, learn=True)
+    return {
+        'anomaly': self.tm.anomaly,
+    }
+
+
+def read_records(count):
+    records = []
+    with open(_INPUT_FILE_PATH, "r") as fin:
+        reader = csv.reader(fin)
+        next(reader)
+        next(reader)
+        next(reader)
+
+        for record in reader:
+            dateString = datetime.strptime(record[0], "%m/%d/%y %H:%M")
+            records.append({
+                'timestamp': int(dateString.timestamp()),
+                'consumption': float(record[1]),
+            })
+
+            if len(records) >= count:
+                break
+
+    return records
+
+
+def bench(name, run, records):
+    model = Model('bench', Parameters())
+    model.create()
+
+    start = time.perf_counter()
+    for record in records:
+        run(model, **record)
+
+    spent = time.perf_counter() - start
+    print('{:<12} {:>8.1f} us/record'.format(name,
+                                             spent * 1e6 / len(records)))
+
+
+def main(args):
+    records = read_records(args.records)
+    bench('allocating', allocating_run, records)
+    bench('preallocated', Model.run, records)
+
+
+if __name__ == '__main__':
+    import sys
+    main(parse_args(sys.argv[1:]))
@@ -22,6 +22,12 @@ def parse_args(argv):
                         default='tcp://:5000',
                         type=str,
                         help='Periodicd host')
+    parser.add_argument('-b',
+                        '--batch',
+                        dest='batch',
+                        default=0,
+                        type=int,
+                        help='Send records with run_model_batch')
     args = parser.parse_args(argv)
     return args
 
@@ -57,6 +63,30 @@ async def main(args):
             print(e)
             await asyncio.sleep(10)
 
+    async def submit_batch(batch):
+        data = {
+            'name': metric_name,
+            'model_name': 'hotgym',
+            'records': batch,
+        }
+        name = '{}{}'.format(metric_name, batch[0]['timestamp'])
+        try:
+            v = await client.run_job(func.format('run_model_batch'),
+                                     name,
+                                     bytes(json.dumps(data), 'utf-8'),
+                                     timeout=30)
+            try:
+                data = json.loads(str(v, 'utf-8'))
+                for r in data['records']:
+                    print('value={} anomaly={}'.format(
+                        r['consumption'], r.get('anomaly')))
+            except Exception:
+                print(v)
+
+        except Exception as e:
+            print(e)
+            await asyncio.sleep(10)
+
     # Read the input file.
     records = []
     with open(_INPUT_FILE_PATH, "r") as fin:
@@ -69,15 +99,29 @@ async def main(args):
     for i in range(100):
         records.append(random.choice(records))
 
+    batch = []
     for record in records:
         # Convert data string into Python date object.
         dateString = datetime.datetime.strptime(record[0], "%m/%d/%y %H:%M")
         # Convert data value string into float.
         consumption = float(record[1])
 
+        if args.batch > 0:
+            batch.append({
+                'timestamp': dateString.timestamp(),
+                'consumption': consumption
+            })
+            if len(batch) >= args.batch:
+                await submit_batch(batch)
+                batch = []
+            continue
+
         await submit({
             'name': metric_name,
             'timestamp': dateString.timestamp(),
             'model_name': 'hotgym',
             'consumption': consumption
         })
+
+    if batch:
+        await submit_batch(batch)
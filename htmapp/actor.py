@@ -0,0 +1,76 @@
+import asyncio
+import logging
+
+logger = logging.getLogger(__name__)
+
+
+# owns one metric, runs its jobs one by one in arrival order
+class Actor(object):
+    def __init__(self, name, system):
+        self.name = name
+        self.system = system
+        self.queue = asyncio.Queue()
+        self.task = None
+
+    def start(self):
+        self.task = asyncio.ensure_future(self._run())
+
+    async def _run(self):
+        loop = asyncio.get_event_loop()
+        while True:
+            try:
+                func, args, future = await asyncio.wait_for(
+                    self.queue.get(), self.system.idle)
+            except asyncio.TimeoutError:
+                if self.queue.empty():
+                    self.system.reclaim(self)
+                    return
+
+                continue
+
+            if future.done():
+                continue
+
+            try:
+                async with self.system.slots:
+                    result = await loop.run_in_executor(
+                        self.system.executor, func, *args)
+            except Exception as e:
+                if not future.done():
+                    future.set_exception(e)
+                continue
+
+            if not future.done():
+                future.set_result(result)
+
+
+class ActorSystem(object):
+    def __init__(self, size=4, idle=60, executor=None):
+        self.idle = idle
+        self.executor = executor
+        # compute slots shared by all actors
+        self.slots = asyncio.Semaphore(size)
+        self.actors = {}
+
+    def submit(self, name, func, *args):
+        actor = self.actors.get(name)
+        if actor is None:
+            actor = self.actors[name] = Actor(name, self)
+            actor.start()
+
+        future = asyncio.get_event_loop().create_future()
+        actor.queue.put_nowait((func, args, future))
+        return future
+
+    def reclaim(self, actor):
+        if self.actors.get(actor.name) is actor:
+            self.actors.pop(actor.name)
+
+    def active_count(self):
+        return len(self.actors)
+
+    def stop(self):
+        for actor in list(self.actors.values()):
+            actor.task.cancel()
+
+        self.actors.clear()
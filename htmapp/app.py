@@ -1,17 +1,66 @@
 from .checkpoint import CheckPoint
-from .cache import Cache, CacheItem
+from .cache import Cache
 from aio_periodic import Blueprint, rsp
 import os
 import os.path
 import pickle
+import asyncio
+import logging
 from .base_model import BaseModel
+from .dispatch import Coalescer
+from .actor import ActorSystem
+from .snapshot import Snapshot, Snapshots
 from .config import parameters
 
+logger = logging.getLogger(__name__)
+
 cache = Cache()
 app = Blueprint()
+snapshots = Snapshots()
+uploads = Snapshots()
+snapshot_chunk_size = 1 << 20
+
+
+def open_model(name, new_model_name=None, load=True):
+    item = cache.get(name)
+    if item and item.get_model() is not None:
+        return item.get_model(), None
+
+    checkpoint = CheckPoint(os.path.join(cache.checkpoint_root, name))
+
+    model_name = checkpoint.get_model_name()
+    if not model_name and new_model_name:
+        model_name = new_model_name
+
+    if not model_name:
+        return None, {'err': 'model not found.'}
+
+    checkpoint.set_default_parameters(parameters.get(model_name, {}))
+
+    Model = BaseModel.get(model_name)
+
+    if not Model:
+        return None, {'err': 'model not found.'}
+
+    if not load:
+        return Model(name, checkpoint, cache), None
+
+    def loader():
+        model = Model(name, checkpoint, cache)
+        if model.initialize():
+            return model
+
+        return None
+
+    # concurrent jobs of an uncached metric share one load
+    model = cache.get_or_load(name, loader)
+    if model is None:
+        return None, {'err': 'model initialize failed.'}
+
+    return model, None
 
 
-def prepare(is_json=False):
+def prepare(is_json=False, load=True):
     def _prepare(func):
         def __prepare(job):
             name = job.name
@@ -23,23 +72,10 @@ def prepare(is_json=False):
                 name = data.pop('name', name)
                 new_model_name = data.pop('model_name', 'hotgym')
 
-            checkpoint = CheckPoint(os.path.join(cache.checkpoint_root, name))
-
-            model_name = checkpoint.get_model_name()
-            if not model_name and new_model_name:
-                model_name = new_model_name
-
-            if not model_name:
-                return rsp.json({'err': 'model not found.'})
+            model, err = open_model(name, new_model_name, load)
+            if err:
+                return rsp.json(err)
 
-            checkpoint.set_default_parameters(parameters.get(model_name, {}))
-
-            Model = BaseModel.get(model_name)
-
-            if not Model:
-                return rsp.json({'err': 'model not found.'})
-
-            model = Model(name, checkpoint, cache)
             return rsp.done(func(model, data))
 
         return __prepare
@@ -48,7 +84,7 @@ def prepare(is_json=False):
 
 
 @app.func('reset_model')
-@prepare(is_json=True)
+@prepare(is_json=True, load=False)
 def run_reset_model(model, parameters):
     if isinstance(parameters, dict):
         model.checkpoint.set_parameters(parameters)
@@ -77,50 +113,173 @@ def run_save_models(job):
 @app.func('save_model')
 @prepare()
 def run_set_save_model(model, data):
-    with model:
+    if not model.initialize():
+        return
+
+    # saving does not change the model, leave the item clean afterwards
+    with model.lock.read():
         model.save()
 
 
+def take_snapshot(name, snapshot):
+    item = cache.get(name)
+    model = item.get_model() if item else None
+    if model is not None:
+        # training waits while the model is pickled, streaming does not
+        with model.lock.read():
+            snapshot.dump(model.prepare_save())
+        return
+
+    checkpoint = CheckPoint(os.path.join(cache.checkpoint_root, name))
+    snapshot.dump(checkpoint.load())
+
+
 @app.func('get_model')
 def run_get_model(job):
-    name = job.name
-    item = cache.get(name)
-    model = None
-    if item:
-        model = item.get_model()
+    snapshot = Snapshot(job.name, 0)
+    try:
+        take_snapshot(job.name, snapshot)
+        snapshot.file.seek(0)
+        return rsp.done(snapshot.file.read())
+    finally:
+        snapshot.close()
+
+
+@app.func('get_model_begin')
+def run_get_model_begin(job):
+    chunk_size = snapshot_chunk_size
+    if job.workload:
+        chunk_size = int(job.workload_json.get('chunk_size', chunk_size))
+
+    snapshot = Snapshot(job.name, max(chunk_size, 1))
+    try:
+        take_snapshot(job.name, snapshot)
+    except Exception:
+        snapshot.close()
+        raise
+
+    snapshots.add(snapshot)
+    return rsp.json(snapshot.info())
+
+
+@app.func('get_model_chunk')
+def run_get_model_chunk(job):
+    data = job.workload_json
+    snapshot = snapshots.get(data.get('id'))
+    if snapshot is None:
+        return rsp.done()
+
+    return rsp.done(snapshot.read(int(data.get('index', 0))))
+
 
+@app.func('get_model_end')
+def run_get_model_end(job):
+    data = job.workload_json
+    snapshots.remove(data.get('id'))
+    return rsp.done()
+
+
+def install_model(name, saved):
+    if not isinstance(saved, dict):
+        return False
+
+    model_name = saved.get('model_name')
+    checkpoint = CheckPoint(os.path.join(cache.checkpoint_root, name))
+    checkpoint.invalidate()
+    checkpoint.set_default_parameters(parameters.get(model_name, {}))
+
+    model = BaseModel.from_saved(name, checkpoint, saved, cache)
     if model is None:
-        checkpoint = CheckPoint(os.path.join(cache.checkpoint_root, name))
-        model = checkpoint.load()
+        return False
+
+    checkpoint.set_model_name(model_name)
 
-    return rsp.done(pickle.dumps(model))
+    # the imported model does not follow this worker's input log
+    log = checkpoint.get_input_log()
+    if log:
+        log.truncate()
+
+    # the old item is marked updated and swapped out in one step
+    model.attach(replace=True)
+    # jobs may already train the attached model, pickle a consistent state
+    with model.lock.read():
+        model.save()
+
+    return True
 
 
 @app.func('put_model')
 def run_put_model(job):
-    name = job.name
-    model = None
+    saved = None
     try:
-        model = pickle.loads(job.workload)
+        saved = pickle.loads(job.workload)
     except Exception:
         return rsp.done()
 
-    item = cache.get(name)
-    if item:
-        item.set_updated(True)
-    else:
-        item = CacheItem(name)
-        cache.set(item)
+    install_model(job.name, saved)
+    return rsp.done()
 
-    item.set_model(model)
-    cache.save_item(item)
 
-    return rsp.done()
+def import_upload(upload):
+    try:
+        saved = upload.load()
+    except Exception as e:
+        logger.exception(e)
+        return False
+
+    return install_model(upload.name, saved)
+
+
+@app.func('put_model_begin')
+def run_put_model_begin(job):
+    chunk_size = snapshot_chunk_size
+    if job.workload:
+        chunk_size = int(job.workload_json.get('chunk_size', chunk_size))
+
+    upload = Snapshot(job.name, max(chunk_size, 1))
+    uploads.add(upload)
+    return rsp.json({'id': upload.id, 'chunk_size': upload.chunk_size})
+
+
+# job name is '<metric>:<upload id>:<index>', the workload is the chunk
+@app.func('put_model_append')
+def run_put_model_append(job):
+    _, sid, index = job.name.rsplit(':', 2)
+    upload = uploads.get(sid)
+    if upload is None:
+        return rsp.json({'err': 'upload not found.'})
+
+    upload.write(int(index), job.workload)
+    return rsp.json({'size': upload.size})
+
+
+@app.func('put_model_commit')
+async def run_put_model_commit(job):
+    data = job.workload_json
+    upload = uploads.get(data.get('id'))
+    if upload is None:
+        return rsp.json({'err': 'upload not found.'})
+
+    try:
+        if upload.size != data.get('size', upload.size):
+            return rsp.json({'err': 'upload truncated.'})
+
+        # unpickle, swap and save off the handler threads
+        loop = asyncio.get_event_loop()
+        if not await loop.run_in_executor(None, import_upload, upload):
+            return rsp.json({'err': 'invalid model.'})
+    finally:
+        uploads.remove(upload.id)
+
+    return rsp.json({'size': upload.size})
 
 
 def get_locker(job):
     name = job.name
     data = job.workload_json
+    if not isinstance(data, dict):
+        return None, None
+
     name = data.get('name', name)
     model_name = data.get('model_name')
     model = BaseModel.get(model_name)
@@ -130,15 +289,184 @@ def get_locker(job):
     return None, None
 
 
+def feed_record(model, data):
+    if not isinstance(data, dict):
+        return None
+
+    if model.is_train(**data):
+        with model:
+            v = model.feed(data)
+    else:
+        # inference shares the model and leaves the cache item alone
+        v = model.infer(data)
+
+    if v:
+        data.update(v)
+
+    return data
+
+
 @app.func('run_model', locker=get_locker)
 @prepare(is_json=True)
 def run_model(model, data):
+    return feed_record(model, data)
+
+
+def get_batch_locker(job):
+    name = job.name
+    data = job.workload_json
+    if not isinstance(data, dict):
+        return None, None
+
+    name = data.get('name', name)
+    model_name = data.get('model_name')
+    model = BaseModel.get(model_name)
+    if model:
+        records = data.get('records')
+        if not isinstance(records, list):
+            return None, None
+
+        for record in records:
+            # feed_batch skips non dict records, so does the locker
+            if isinstance(record, dict) and model.is_train(**record):
+                return name, 1
+
+    return None, None
+
+
+def feed_batch(model, data):
     if not isinstance(data, dict):
         return None
 
-    with model:
-        v = model.run(**data)
+    records = data.get('records')
+    if not isinstance(records, list):
+        return None
+
+    batch = [record for record in records if isinstance(record, dict)]
+    if any(model.is_train(**record) for record in batch):
+        with model:
+            outputs = iter(model.feed_batch(batch))
+    else:
+        outputs = iter(model.infer_batch(batch))
+
+    results = []
+    for record in records:
+        if not isinstance(record, dict):
+            results.append(None)
+            continue
+
+        v = next(outputs)
         if v:
-            data.update(v)
+            record.update(v)
+
+        results.append(record)
+
+    return {'records': results}
+
+
+@app.func('run_model_batch', locker=get_batch_locker)
+@prepare(is_json=True)
+def run_model_batch(model, data):
+    return feed_batch(model, data)
+
+
+def is_inference(model_name, records):
+    Model = BaseModel.get(model_name)
+    if not Model:
+        return False
+
+    records = [record for record in records if isinstance(record, dict)]
+    return not any(Model.is_train(**record) for record in records)
 
-        return data
+
+def run_coalesced(name, model_name, records):
+    model, err = open_model(name, model_name)
+    if err:
+        return [err for _ in records]
+
+    results = []
+    with model:
+        for record in records:
+            try:
+                v = model.feed(record)
+                if v:
+                    record.update(v)
+
+                results.append(record)
+            except Exception as e:
+                results.append(e)
+
+    return results
+
+
+def enable_coalesce(window, max_batch, executor=None):
+    coalescer = Coalescer(run_coalesced, window, max_batch, executor)
+
+    @app.func('run_model')
+    async def run_model_coalesced(job):
+        data = job.workload_json
+        if not isinstance(data, dict):
+            return rsp.done()
+
+        name = data.pop('name', job.name)
+        model_name = data.pop('model_name', 'hotgym')
+        if is_inference(model_name, [data]):
+            loop = asyncio.get_event_loop()
+            v, err = await loop.run_in_executor(executor, run_owned,
+                                                feed_record, name,
+                                                model_name, data)
+            return rsp.json(err) if err else rsp.done(v)
+
+        v = await coalescer.submit(name, model_name, data)
+        if 'err' in v and len(v) == 1:
+            return rsp.json(v)
+
+        return rsp.done(v)
+
+    # jobs of one metric are ordered by the coalescer, not periodicd
+    app.lockers.pop('run_model', None)
+
+
+def run_owned(func, name, model_name, data):
+    model, err = open_model(name, model_name)
+    if err:
+        return None, err
+
+    return func(model, data), None
+
+
+def enable_actors(size, idle, executor=None):
+    actors = ActorSystem(size, idle, executor)
+
+    def route(func, get_records):
+        async def _route(job):
+            data = job.workload_json
+            if not isinstance(data, dict):
+                return rsp.done()
+
+            name = data.pop('name', job.name)
+            model_name = data.pop('model_name', 'hotgym')
+            if is_inference(model_name, get_records(data)):
+                # readers share the model, no need to queue on the actor
+                loop = asyncio.get_event_loop()
+                v, err = await loop.run_in_executor(executor, run_owned,
+                                                    func, name, model_name,
+                                                    data)
+            else:
+                v, err = await actors.submit(name, run_owned, func, name,
+                                             model_name, data)
+            if err:
+                return rsp.json(err)
+
+            return rsp.done(v)
+
+        return _route
+
+    app.func('run_model')(route(feed_record, lambda data: [data]))
+    app.func('run_model_batch')(route(
+        feed_batch, lambda data: data.get('records') or []))
+
+    # each metric is owned by one actor, periodicd need not lock it
+    app.lockers.pop('run_model', None)
+    app.lockers.pop('run_model_batch', None)
+    return actors
@@ -1,9 +1,13 @@
 from .cache import CacheItem
+from .rwlock import RWLock
+from . import codec
 from importlib import import_module
+from importlib.metadata import entry_points
 import time
-import os
-import os.path
-from glob import glob
+import json
+import logging
+
+logger = logging.getLogger(__name__)
 
 
 class ModelError(Exception):
@@ -13,6 +17,13 @@ class ModelError(Exception):
 class BaseModel(object):
     model_name = 'base_model'
     models = {}
+    registry = {
+        'hotgym': 'htmapp.models.hotgym:Model',
+        'simhash': 'htmapp.models.simhash:Model',
+    }
+    entry_points_loaded = False
+    # (model_name, parameters) -> pickled size of a freshly created model
+    size_estimates = {}
 
     def __init__(self, name, checkpoint, cache=None):
         self.name = name
@@ -22,6 +33,9 @@ class BaseModel(object):
         self.save_delay = 0  # 超过一定时间，自动保存 model
         self._cache = cache
         self._cache_item = None
+        self.log_seq = 0  # last input log record applied to this model
+        # training holds it exclusively, inference and saves share it
+        self.lock = RWLock()
 
         self.save_keys = ['last_save_time', 'save_delay']
 
@@ -39,11 +53,12 @@ class BaseModel(object):
 
             setattr(self, key, val)
 
+        self.log_seq = model.get('log_seq', 0)
         self.initialized = True
         return True
 
     def prepare_save(self):
-        saved = {'model_name': self.model_name}
+        saved = {'model_name': self.model_name, 'log_seq': self.log_seq}
 
         for key in self.save_keys:
             val = getattr(self, key, None)
@@ -53,7 +68,94 @@ class BaseModel(object):
 
     def save(self):
         self.last_save_time = time.time()
-        self.checkpoint.save(self.prepare_save())
+        size = self.checkpoint.save(self.prepare_save(), self.on_saved())
+        self.set_size(size)
+        return size
+
+    def set_size(self, size):
+        # the serialized size stands in for the memory footprint
+        if self._cache and self._cache_item and size:
+            self._cache.set_item_size(self._cache_item, size)
+
+    def estimate_size(self):
+        parameters = json.dumps(self.checkpoint.get_parameters(),
+                                sort_keys=True)
+        key = (self.model_name, parameters)
+        size = self.size_estimates.get(key)
+        if size is None:
+            counter = codec.CountingWriter()
+            codec.dump(self.prepare_save(), counter, self.checkpoint.native)
+            size = self.size_estimates[key] = counter.size
+
+        return size
+
+    def on_saved(self):
+        log = self.checkpoint.get_input_log()
+        seq = self.log_seq
+        item = self._cache_item
+        version = item.get_version() if item else 0
+
+        def callback():
+            if log:
+                log.truncate(seq)
+
+            if item:
+                item.set_saved(version)
+
+        return callback
+
+    def feed(self, record):
+        log = self.checkpoint.get_input_log()
+        if log and self.is_train(**record):
+            self.log_seq += 1
+            log.append(self.log_seq, record)
+
+        return self.run(**record)
+
+    def feed_batch(self, records):
+        log = self.checkpoint.get_input_log()
+        if log:
+            for record in records:
+                if self.is_train(**record):
+                    self.log_seq += 1
+                    log.append(self.log_seq, record)
+
+        return self.run_batch(records)
+
+    def run_batch(self, records):
+        return [self.run(**record) for record in records]
+
+    def infer(self, record):
+        if not self.initialize():
+            raise ModelError('Initialize failed.')
+
+        with self.lock.read():
+            return self.run(**record)
+
+    def infer_batch(self, records):
+        if not self.initialize():
+            raise ModelError('Initialize failed.')
+
+        with self.lock.read():
+            return self.run_batch(records)
+
+    def replay(self):
+        log = self.checkpoint.get_input_log()
+        if not log:
+            return
+
+        records = log.replay(self.log_seq)
+        if records:
+            logger.info('Replay {} records for {}'.format(
+                len(records), self.name))
+
+        for seq, record in records:
+            try:
+                self.run(**record)
+            except Exception as e:
+                logger.exception(e)
+
+            self.log_seq = seq
 
     def auto_save(self):
         if self.save_delay == 0:
@@ -66,32 +168,42 @@ class BaseModel(object):
         self.save_delay = delay
 
     def load(self):
-        if self._cache:
-            self._cache_item = self._cache.get(self.name)
-            if self._cache_item and self._cache_item.get_model():
-                self._cache_item.set_updated(False)
-                return self.prepare(self._cache_item.get_model())
-
         model = self.checkpoint.load()
         if model is None:
             return False
 
-        if self._cache:
-            self._cache_item = CacheItem(self.name, model)
-            self._cache.set(self._cache_item)
+        return self.restore(model, self.checkpoint.loaded_size)
+
+    def restore(self, model, size=0):
+        if not self.prepare(model):
+            return False
 
-        return self.prepare(model)
+        self.replay()
+        self.attach()
+        self.set_size(size)
+        return True
+
+    def attach(self, replace=False):
+        # keep this instance resident, later jobs reuse it with encoders
+        if self._cache:
+            self._cache_item = CacheItem(self.name, self)
+            if replace:
+                self._cache.replace(self._cache_item)
+            else:
+                self._cache.set(self._cache_item)
 
     def initialize(self):
         if not self.initialized:
             if not self.load():
                 self.create()
                 self.checkpoint.set_model_name(self.model_name)
-                if self._cache:
-                    self._cache_item = CacheItem(self.name,
-                                                 self.prepare_save())
-                    self._cache.set(self._cache_item)
-
+                # records logged before the first snapshot
+                self.replay()
+                self.attach()
+                if self._cache_item:
+                    # never saved yet, count it against --cache-memory anyway
+                    self.set_size(self.estimate_size())
+                    self._cache_item.mark_dirty()
                 self.initialized = True
 
         return self.initialized
@@ -107,33 +219,70 @@ class BaseModel(object):
         if not self.initialize():
             raise ModelError('Initialize failed.')
 
+        self.lock.acquire_write()
         return self
 
     def __exit__(self, type, value, traceback):
-        if self._cache_item:
-            if self._cache_item.get_updated():
+        try:
+            # the cache item was replaced by reset_model or put_model
+            if self._cache_item and self._cache_item.get_updated():
                 return
-            self._cache_item.set_updated(True)
 
-        self.auto_save()
+            if self._cache_item:
+                self._cache_item.mark_dirty()
+        finally:
+            self.lock.release_write()
+
+        # saving only reads the model, let inference run meanwhile
+        with self.lock.read():
+            self.auto_save()
+
+    @classmethod
+    def from_saved(cls, name, checkpoint, saved, cache=None):
+        Model = cls.get(saved.get('model_name'))
+        if not Model:
+            return None
+
+        model = Model(name, checkpoint, cache)
+        if not model.prepare(saved):
+            return None
 
-        if self._cache_item:
-            self._cache_item.set_model(self.prepare_save())
+        return model
+
+    @classmethod
+    def register(cls, model_name, path):
+        # path is 'module:ClassName', imported on first get
+        cls.registry[model_name] = path
 
     @classmethod
     def load_models(cls):
-        path = os.path.dirname(__file__)
-        for model in glob(os.path.join(path, 'models', '*.py')):
-            module_name = os.path.basename(model)[:-3]
-            module = import_module('htmapp.models.' + module_name)
-            for cls_name in dir(module):
-                cls = getattr(module, cls_name, None)
-                if hasattr(cls, 'model_name'):
-                    if cls.model_name == 'base_model':
-                        continue
-
-                    cls.models[cls.model_name] = cls
+        if cls.entry_points_loaded:
+            return
+
+        cls.entry_points_loaded = True
+        eps = entry_points()
+        if hasattr(eps, 'select'):
+            eps = eps.select(group='htmapp.models')
+        else:
+            eps = eps.get('htmapp.models', [])
+
+        for ep in eps:
+            cls.registry.setdefault(ep.name, ep.value)
 
     @classmethod
     def get(cls, name):
-        return cls.models.get(name, None)
+        Model = cls.models.get(name)
+        if Model:
+            return Model
+
+        if name not in cls.registry:
+            cls.load_models()
+
+        path = cls.registry.get(name)
+        if not path:
+            return None
+
+        module_name, _, attr = path.partition(':')
+        Model = getattr(import_module(module_name), attr)
+        cls.models[name] = Model
+        return Model
@@ -1,6 +1,10 @@
 import time
-from .checkpoint import CheckPoint
-import os
+from .checkpoint import checkpoint_writer
+from collections import OrderedDict
+from threading import Event, Lock, RLock
+import logging
+
+logger = logging.getLogger(__name__)
 
 
 class CacheItem(object):
@@ -9,6 +13,11 @@ class CacheItem(object):
         self.model = model
         self.updated = False
         self.timestamp = time.time()
+        # bumped on every change, saved_version is the last one on disk
+        self.version = 0
+        self.saved_version = 0
+        self.version_lock = Lock()
+        self.size = 0  # estimated memory footprint in bytes
 
     def __eq__(self, item):
         return self.name == item.name
@@ -33,45 +42,239 @@ class CacheItem(object):
     def get_updated(self):
         return self.updated
 
+    def mark_dirty(self):
+        with self.version_lock:
+            self.version += 1
+
+    def get_version(self):
+        return self.version
+
+    def set_saved(self, version):
+        with self.version_lock:
+            self.saved_version = max(self.saved_version, version)
+
+    def is_dirty(self):
+        return self.version != self.saved_version
+
+    def get_size(self):
+        return self.size
+
+
+class Flight(object):
+    def __init__(self):
+        self.event = Event()
+        self.model = None
+
 
 class Cache(object):
-    def __init__(self, size=10, checkpoint_root=None):
-        self.size = size
-        self.items = []
+    def __init__(self, size=10, checkpoint_root=None, memory=0):
+        self.size = size  # max models, 0 means no limit
+        self.memory = memory  # max estimated bytes, 0 means no limit
+        self.used = 0
+        # name -> CacheItem, least recently used first
+        self.items = OrderedDict()
+        # evicted items waiting for the hibernate loop to save them
+        self.evicted = OrderedDict()
+        # set when a hibernate loop runs, otherwise evict saves in place
+        self.background = False
+        # name -> Flight of the thread loading that model
+        self.loading = {}
         self.checkpoint_root = checkpoint_root
+        self.lock = RLock()
+
+    def is_full(self):
+        if self.size > 0 and len(self.items) > self.size:
+            return True
+
+        return self.memory > 0 and self.used > self.memory
+
+    def evict(self):
+        victims = []
+        with self.lock:
+            # never evict the most recently used item
+            while len(self.items) > 1 and self.is_full():
+                name, victim = self.items.popitem(last=False)
+                self.used -= victim.size
+                if self.background:
+                    self.evicted[name] = victim
+                else:
+                    victims.append(victim)
+
+        for victim in victims:
+            self.save_item(victim)
 
     def set(self, new):
-        for item in self.items:
-            if item == new:
+        with self.lock:
+            name = new.get_name()
+            if name in self.items:
+                self.items.move_to_end(name)
                 return
 
-        self.items.append(new)
+            # not measured yet, assume an average model
+            if new.size == 0 and self.items:
+                new.size = self.used // len(self.items)
+
+            self.items[name] = new
+            self.used += new.size
+
+        self.evict()
 
-        if len(self.items) > self.size:
-            items = sorted(self.items, key=lambda x: x.timestamp)
-            self.save_item(items[0])
+    def set_item_size(self, item, size):
+        with self.lock:
+            if self.items.get(item.get_name()) is item:
+                self.used += size - item.size
 
-            self.items.remove(items[0])
+            item.size = size
+
+        self.evict()
 
     def get(self, name):
-        for item in self.items:
-            if item.get_name() == name:
+        with self.lock:
+            item = self.items.get(name)
+            if item is not None:
+                self.items.move_to_end(name)
+                item.timestamp = time.time()
                 return item
 
-        return None
+            # evicted but not saved yet, take it back
+            item = self.evicted.pop(name, None)
+            if item is None:
+                return None
+
+            item.timestamp = time.time()
+            self.items[name] = item
+            self.used += item.size
+
+        self.evict()
+        return item
+
+    def get_or_load(self, name, loader):
+        while True:
+            item = self.get(name)
+            if item and item.get_model() is not None:
+                return item.get_model()
+
+            with self.lock:
+                flight = self.loading.get(name)
+                owner = flight is None
+                if owner:
+                    flight = Flight()
+                    self.loading[name] = flight
+
+            if owner:
+                break
+
+            # another thread is loading it, share its result
+            flight.event.wait()
+            if flight.model is not None:
+                return flight.model
+
+        try:
+            flight.model = loader()
+            return flight.model
+        finally:
+            with self.lock:
+                self.loading.pop(name, None)
+
+            flight.event.set()
 
     def remove(self, name):
-        item = CacheItem(name)
-        if item in self.items:
-            self.items.remove(item)
+        with self.lock:
+            self.evicted.pop(name, None)
+            item = self.items.pop(name, None)
+            if item is not None:
+                self.used -= item.size
+
+    def replace(self, new):
+        name = new.get_name()
+        with self.lock:
+            old = self.evicted.pop(name, None)
+            item = self.items.pop(name, None)
+            if item is not None:
+                self.used -= item.size
+                old = item
+
+            if old is not None:
+                old.set_updated(True)
+
+            self.items[name] = new
+            self.used += new.size
+
+        self.evict()
+        return old
+
+    def hibernate(self, ttl=0):
+        now = time.time()
+        with self.lock:
+            # oldest first, so stop at the first item still in use
+            while ttl > 0 and self.items:
+                name, item = next(iter(self.items.items()))
+                if item.get_timestamp() + ttl > now:
+                    break
+
+                del self.items[name]
+                self.used -= item.size
+                self.evicted[name] = item
+
+            names = list(self.evicted)
+
+        saved = 0
+        for name in names:
+            with self.lock:
+                item = self.evicted.get(name)
+
+            if item is None:
+                continue
+
+            if item.is_dirty():
+                self.save_item(item)
+                saved += 1
+
+            with self.lock:
+                if self.evicted.get(name) is item:
+                    del self.evicted[name]
+
+        if names:
+            logger.info('Hibernate {} models, {} saved'.format(
+                len(names), saved))
+
+        return len(names)
 
     def save_item(self, item):
         if self.checkpoint_root is not None:
-            name = item.get_name()
             model = item.get_model()
-            chk = CheckPoint(os.path.join(self.checkpoint_root, name))
-            chk.save(model)
+            if model is not None:
+                with model.lock.read():
+                    return model.save()
+
+    def save_items(self, progress_interval=5):
+        with self.lock:
+            items = list(self.items.values()) + list(self.evicted.values())
+
+        dirty = [item for item in items if item.is_dirty()]
+        logger.info('Save {} of {} cached models, {} clean'.format(
+            len(dirty), len(items),
+            len(items) - len(dirty)))
+
+        start = time.time()
+        written_bytes = checkpoint_writer.written_bytes
+        last_report = start
+        pickled_bytes = 0
+
+        # pickling needs the GIL, the writer compresses in parallel
+        for i, item in enumerate(dirty):
+            pickled_bytes += self.save_item(item) or 0
+
+            if time.time() - last_report > progress_interval:
+                last_report = time.time()
+                logger.info('Saving models: {}/{}'.format(i + 1, len(dirty)))
+
+        while not checkpoint_writer.flush(progress_interval):
+            logger.info('Saving models: {} writes pending'.format(
+                checkpoint_writer.pending_count()))
 
-    def save_items(self):
-        for item in self.items:
-            self.save_item(item)
+        logger.info('Saved {} models in {:.2f}s, {} bytes pickled, '
+                    '{} bytes written'.format(
+                        len(dirty),
+                        time.time() - start, pickled_bytes,
+                        checkpoint_writer.written_bytes - written_bytes))
@@ -1,135 +1,269 @@
 import os
 import os.path
 from time import time
-import glob
-import pickle
 import json
-import gzip
-from multiprocessing import Process
+from collections import deque
+from threading import Lock
+from weakref import WeakValueDictionary
+from .writer import CheckPointWriter
+from .store import DirectoryStore
+from . import codec
 import logging
 
 logger = logging.getLogger(__name__)
 
+_MISSING = object()
 
-def safe_float(v):
-    try:
-        return float(v)
-    except Exception:
-        return 0
+
+# pickle output kept as the pickler's frames, never joined into one bytes
+class ChunkBuffer(object):
+    def __init__(self, native=False, callback=None):
+        self.chunks = deque()
+        self.size = 0
+        self.native = native
+        # called once the snapshot is written
+        self.callback = callback
+
+    def write(self, data):
+        # large frames arrive as the pickler's live buffers, copy them
+        if not isinstance(data, bytes):
+            data = memoryview(data).tobytes()
+
+        self.chunks.append(data)
+        self.size += len(data)
+        return len(data)
+
+    def freeze(self):
+        # submitted buffers are shared with load(), never mutate them again
+        self.chunks = tuple(self.chunks)
+
+    def write_to(self, f):
+        for chunk in self.chunks:
+            f.write(chunk)
+
+    def getvalue(self):
+        return b''.join(self.chunks)
+
+    def serializer(self):
+        return 'native' if self.native else 'pickle'
+
+
+# process wide cache of checkpoint metadata, keyed by checkpoint directory
+class MetaCache(object):
+    def __init__(self):
+        self.metas = {}
+        self.lock = Lock()
+
+    def get(self, path, key):
+        with self.lock:
+            return self.metas.get(path, {}).get(key, _MISSING)
+
+    def set(self, path, key, value):
+        with self.lock:
+            self.metas.setdefault(path, {})[key] = value
+
+    def invalidate(self, path, key=None):
+        with self.lock:
+            if key is None:
+                self.metas.pop(path, None)
+            else:
+                self.metas.get(path, {}).pop(key, None)
+
+
+meta_cache = MetaCache()
+checkpoint_writer = CheckPointWriter()
+
+# one live log per metric, dropped once nothing holds it
+input_logs = WeakValueDictionary()
+input_logs_lock = Lock()
 
 
 class CheckPoint(object):
+    # set per worker, see --codec, --native, --input-log and --store
+    save_codec = codec.GzipCodec()
+    native = False
+    input_log = False
+    store = DirectoryStore()
+
     def __init__(self, checkpoint, generation=2):
         self.checkpoint = checkpoint
-        self.checkpoint_path = os.path.join(self.checkpoint, 'checkpoint')
-        if not os.path.isdir(checkpoint):
-            os.makedirs(checkpoint)
+        if meta_cache.get(checkpoint, 'exists') is _MISSING:
+            self.store.ensure(checkpoint)
+            meta_cache.set(checkpoint, 'exists', True)
 
         self.generation = generation
+        # uncompressed size of the last loaded snapshot
+        self.loaded_size = 0
+
+    def _cached(self, key, read):
+        value = meta_cache.get(self.checkpoint, key)
+        if value is _MISSING:
+            value = read()
+            meta_cache.set(self.checkpoint, key, value)
+
+        return value
+
+    def invalidate(self):
+        meta_cache.invalidate(self.checkpoint)
+
+    def get_input_log(self):
+        if not self.input_log:
+            return None
+
+        with input_logs_lock:
+            log = input_logs.get(self.checkpoint)
+            if log is None:
+                log = self.store.input_log(self.checkpoint)
+                input_logs[self.checkpoint] = log
+
+            return log
 
     def _get_checkpoint(self):
-        if not os.path.isfile(self.checkpoint_path):
+        return self._cached('checkpoint', self._read_checkpoint)
+
+    def _read_checkpoint(self):
+        checkpoint = self.store.read(self.checkpoint, 'checkpoint')
+        if checkpoint is None:
             return None
 
-        with open(self.checkpoint_path, 'r') as f:
-            return f.read().strip()
+        return checkpoint.strip()
 
     def _new_checkpoint(self):
         return 'checkpoint-{}'.format(time())
 
     def _write_checkpoint(self, checkpoint):
-        with open(self.checkpoint_path, 'w') as f:
-            f.write(checkpoint)
-
-    def _get_parameters_path(self):
-        return '{}/parameters.json'.format(self.checkpoint)
-
-    def _get_model_name_path(self):
-        return '{}/model_name'.format(self.checkpoint)
+        self.store.write(self.checkpoint, 'checkpoint', checkpoint)
+        meta_cache.set(self.checkpoint, 'checkpoint', checkpoint)
 
     def set_default_parameters(self, parameters):
-        path = self._get_parameters_path()
-        if not os.path.isfile(path):
+        if self.get_parameters() is None:
             self.set_parameters(parameters)
 
     def set_parameters(self, parameters):
-        path = self._get_parameters_path()
-        with open(path, 'w') as f:
-            json.dump(parameters, f, indent=2)
+        self.store.write(self.checkpoint, 'parameters.json',
+                         json.dumps(parameters, indent=2))
+        meta_cache.invalidate(self.checkpoint, 'parameters')
 
     def get_parameters(self):
-        path = self._get_parameters_path()
-        if not os.path.isfile(path):
+        return self._cached('parameters', self._read_parameters)
+
+    def _read_parameters(self):
+        parameters = self.store.read(self.checkpoint, 'parameters.json')
+        if parameters is None:
             return None
 
-        with open(path, 'r') as f:
-            return json.load(f)
+        return json.loads(parameters)
 
     def set_model_name(self, model_name):
-        path = self._get_model_name_path()
-        with open(path, 'w') as f:
-            f.write(model_name)
+        self.store.write(self.checkpoint, 'model_name', model_name)
+        meta_cache.invalidate(self.checkpoint, 'model_name')
 
     def get_model_name(self):
-        path = self._get_model_name_path()
-        if not os.path.isfile(path):
+        return self._cached('model_name', self._read_model_name)
+
+    def _read_model_name(self):
+        model_name = self.store.read(self.checkpoint, 'model_name')
+        if model_name is None:
             return None
 
-        with open(path, 'r') as f:
-            return f.read().strip()
+        return model_name.strip()
 
     def remove_old_file(self):
-        files = glob.glob('{}/checkpoint-*'.format(self.checkpoint))
+        self.store.remove_blobs(self.checkpoint, self.generation)
 
-        checkpoints = []
-        for file in files:
-            fns = file.split('-')
-            checkpoints.append(safe_float(fns[-1]))
+    def codec_save(self, checkpoint, data):
+        def write(f):
+            codec.write_header(f, self.save_codec, data.native)
+            with self.save_codec.writer(f) as w:
+                data.write_to(w)
 
-        checkpoints = sorted(checkpoints, reverse=True)
-        removed = checkpoints[self.generation:]
+        return self.store.write_blob(self.checkpoint, checkpoint, write)
 
-        for t in removed:
-            fn = '{}/checkpoint-{}'.format(self.checkpoint, t)
-            if os.path.isfile(fn):
-                os.remove(fn)
+    def save(self, obj, callback=None):
+        # pickle here for a consistent snapshot, compress and write later
+        data = ChunkBuffer(self.native, callback)
+        codec.dump(obj, data, self.native)
+        data.freeze()
+        checkpoint_writer.submit(self, data)
+        return data.size
 
-    def gzip_save(self, path, data):
-        with gzip.GzipFile(path, 'wb') as f:
-            f.write(data)
-
-    def save(self, obj):
+    def write(self, data):
         checkpoint = self._new_checkpoint()
-        path = os.path.join(self.checkpoint, checkpoint)
-        data = pickle.dumps(obj)
-        logger.info('Save checkpoint: {}'.format(path))
+        logger.info('Save checkpoint: {}'.format(
+            os.path.join(self.checkpoint, checkpoint)))
 
-        p = Process(target=self.gzip_save, args=(path, data))
-        p.start()
-        p.join()
+        size = self.codec_save(checkpoint, data)
 
         self._write_checkpoint(checkpoint)
         self.remove_old_file()
 
-    def load(self):
+        if data.callback:
+            data.callback()
+
+        return size
+
+    def _open_checkpoint(self):
         checkpoint = self._get_checkpoint()
         if not checkpoint:
             return None
 
-        path = os.path.join(self.checkpoint, checkpoint)
-        if not os.path.isfile(path):
-            return None
+        return self.store.open_blob(self.checkpoint, checkpoint)
 
-        logger.info('Load checkpoint: {}'.format(path))
+    def load(self):
         try:
-            with gzip.GzipFile(path, 'rb') as f:
-                data = f.read()
-                return pickle.loads(data)
-        except Exception:
+            # a snapshot still queued for writing is newer than the disk
+            data = checkpoint_writer.peek(self.checkpoint)
+            if data is not None:
+                self.loaded_size = data.size
+                return codec.loads(data.getvalue(), data.serializer())
+
+            f = self._open_checkpoint()
+            if f is None:
+                return None
+
+            logger.info('Load checkpoint: {}'.format(self.checkpoint))
+            with f:
+                model, self.loaded_size = codec.load(f)
+                return model
+        except Exception as e:
+            logger.exception(e)
+            return None
+
+    def decompress(self):
+        f = self._open_checkpoint()
+        if f is None:
             return None
 
+        with f:
+            return codec.decompress(f)
+
+    def is_current(self, checkpoint):
+        # nothing newer was queued or written since checkpoint was read
+        if checkpoint_writer.peek(self.checkpoint) is not None:
+            return False
+
+        return self._read_checkpoint() == checkpoint
+
     def reset(self):
-        files = glob.glob('{}/checkpoint-*'.format(self.checkpoint))
+        checkpoint_writer.discard(self.checkpoint)
+
+        self.store.remove_blobs(self.checkpoint)
+
+        meta_cache.invalidate(self.checkpoint, 'checkpoint')
+
+        log = self.get_input_log()
+        if log:
+            log.truncate()
+
+
+# runs in a process pool, see prewarm
+def decompress_checkpoint(checkpoint, store):
+    CheckPoint.store = store
+    checkpoint = CheckPoint(checkpoint)
+    raw = checkpoint.decompress()
+    if raw is None:
+        return None
 
-        for file in files:
-            os.remove(file)
+    data, serializer = raw
+    # the pointer decompress read, cached by _get_checkpoint
+    return data, serializer, checkpoint._get_checkpoint()
@@ -19,7 +19,8 @@ async def run_job(client,
                   metric_name,
                   value='',
                   is_json=False,
-                  output=None):
+                  output=None,
+                  **kwargs):
     data = await client.run_job(func_name,
                                 metric_name,
                                 timeout=30,
@@ -34,15 +35,92 @@ async def run_job(client,
             print(data)
 
 
+async def get_model(client, func_name, metric_name, output=None, **kwargs):
+    begin = await get_func_name(client, 'get_model_begin', metric_name)
+    chunk = await get_func_name(client, 'get_model_chunk', metric_name)
+    end = await get_func_name(client, 'get_model_end', metric_name)
+
+    data = await client.run_job(begin, metric_name, timeout=30)
+    info = json.loads(str(data, 'utf-8'))
+    workload = {'id': info['id']}
+
+    try:
+        with open(output, 'wb') as f:
+            for index in range(info['chunks']):
+                workload['index'] = index
+                data = await client.run_job(chunk,
+                                            '{}:{}:{}'.format(
+                                                metric_name, info['id'],
+                                                index),
+                                            timeout=30,
+                                            workload=json.dumps(workload))
+                if not data:
+                    raise Exception('snapshot {} expired'.format(info['id']))
+
+                f.write(data)
+
+            if f.tell() != info['size']:
+                raise Exception('snapshot {} truncated'.format(info['id']))
+    finally:
+        await client.run_job(end,
+                             '{}:{}'.format(metric_name, info['id']),
+                             timeout=30,
+                             workload=json.dumps({'id': info['id']}))
+
+
+async def put_model(client,
+                    func_name,
+                    metric_name,
+                    model=None,
+                    chunk_size=1 << 20,
+                    **kwargs):
+    begin = await get_func_name(client, 'put_model_begin', metric_name)
+    append = await get_func_name(client, 'put_model_append', metric_name)
+    commit = await get_func_name(client, 'put_model_commit', metric_name)
+
+    data = await client.run_job(begin,
+                                metric_name,
+                                timeout=30,
+                                workload=json.dumps(
+                                    {'chunk_size': chunk_size}))
+    info = json.loads(str(data, 'utf-8'))
+
+    size = 0
+    with open(model, 'rb') as f:
+        index = 0
+        while True:
+            chunk = f.read(info['chunk_size'])
+            if not chunk:
+                break
+
+            data = await client.run_job(append,
+                                        '{}:{}:{}'.format(
+                                            metric_name, info['id'], index),
+                                        timeout=30,
+                                        workload=chunk)
+            data = json.loads(str(data, 'utf-8'))
+            if 'err' in data:
+                print(data)
+                return
+
+            size += len(chunk)
+            index += 1
+
+    data = await client.run_job(commit,
+                                '{}:{}'.format(metric_name, info['id']),
+                                timeout=300,
+                                workload=json.dumps({
+                                    'id': info['id'],
+                                    'size': size
+                                }))
+    print(json.loads(str(data, 'utf-8')))
+
+
 def prepare_value(args):
     if getattr(args, 'parameters', None):
         with open(args.parameters, 'rb') as f:
             return f.read()
 
-    if getattr(args, 'model', None):
-        with open(args.model, 'rb') as f:
-            return f.read()
-
     if getattr(args, 'delay', None):
         return bytes(json.dumps({'save_delay': args.delay}), 'utf-8')
 
@@ -68,14 +146,14 @@ def parse_args(argv):
     parser_get_model.add_argument('output',
                                   type=str,
                                   help='The output file name.')
-    parser_get_model.set_defaults(func=run_job, action='get_model')
+    parser_get_model.set_defaults(func=get_model, action='get_model')
 
     parser_put_model = subparsers.add_parser('put_model', help='Put model')
     parser_put_model.add_argument('metric', type=str, help='The metric name.')
     parser_put_model.add_argument('model',
                                   type=str,
                                   help='The model file name.')
-    parser_put_model.set_defaults(func=run_job, action='put_model')
+    parser_put_model.set_defaults(func=put_model, action='put_model')
 
     parser_save_model = subparsers.add_parser('save_model', help='Save model')
     parser_save_model.add_argument('metric', type=str, help='The metric name.')
@@ -124,6 +202,7 @@ async def main(args):
                         func_name,
                         args.metric,
                         output=getattr(args, 'output', None),
+                        model=getattr(args, 'model', None),
                         value=prepare_value(args))
 
     if args.action == 'save_models':
@@ -0,0 +1,206 @@
+from contextlib import contextmanager, nullcontext
+from importlib import import_module
+import io
+import pickle
+import gzip
+
+try:
+    import lz4.frame
+except ImportError:
+    lz4 = None
+
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+
+MAGIC = b'HTMC'
+GZIP_MAGIC = b'\x1f\x8b'
+
+
+class CodecError(Exception):
+    pass
+
+
+class RawCodec(object):
+    name = 'raw'
+
+    def __init__(self, level=None):
+        self.level = level
+
+    def writer(self, f):
+        return nullcontext(f)
+
+    def reader(self, f):
+        return nullcontext(f)
+
+
+class GzipCodec(RawCodec):
+    name = 'gzip'
+
+    def writer(self, f):
+        level = 9 if self.level is None else self.level
+        return gzip.GzipFile(fileobj=f, mode='wb', compresslevel=level)
+
+    def reader(self, f):
+        return gzip.GzipFile(fileobj=f, mode='rb')
+
+
+class Lz4Codec(RawCodec):
+    name = 'lz4'
+
+    def writer(self, f):
+        level = 0 if self.level is None else self.level
+        return lz4.frame.LZ4FrameFile(f, 'wb', compression_level=level)
+
+    def reader(self, f):
+        return lz4.frame.LZ4FrameFile(f, 'rb')
+
+
+class ZstdCodec(RawCodec):
+    name = 'zstd'
+
+    def writer(self, f):
+        level = 3 if self.level is None else self.level
+        cctx = zstandard.ZstdCompressor(level=level)
+        return cctx.stream_writer(f, closefd=False)
+
+    def reader(self, f):
+        dctx = zstandard.ZstdDecompressor()
+        return dctx.stream_reader(f, closefd=False)
+
+
+codecs = {
+    'raw': (RawCodec, True),
+    'gzip': (GzipCodec, True),
+    'lz4': (Lz4Codec, lz4 is not None),
+    'zstd': (ZstdCodec, zstandard is not None),
+}
+
+
+def get_codec(spec):
+    name, _, level = spec.partition(':')
+    codec, available = codecs.get(name, (None, False))
+    if codec is None:
+        raise CodecError('Unknown codec {}'.format(name))
+
+    if not available:
+        raise CodecError('Codec {} is not installed'.format(name))
+
+    if level:
+        return codec(int(level))
+
+    return codec()
+
+
+# htm.core objects are written with their own binary serialization
+class NativePickler(pickle.Pickler):
+    def persistent_id(self, obj):
+        if hasattr(obj, 'writeToString') and hasattr(obj, 'loadFromString'):
+            cls = type(obj)
+            return ('htm', cls.__module__, cls.__qualname__,
+                    obj.writeToString())
+
+        return None
+
+
+class NativeUnpickler(pickle.Unpickler):
+    def persistent_load(self, pid):
+        tag, module, qualname, data = pid
+        if tag != 'htm':
+            raise pickle.UnpicklingError('Unsupported persistent id')
+
+        cls = import_module(module)
+        for attr in qualname.split('.'):
+            cls = getattr(cls, attr)
+
+        obj = cls()
+        obj.loadFromString(data)
+        return obj
+
+
+# counts the uncompressed bytes the unpickler consumed
+class CountingReader(object):
+    def __init__(self, f):
+        self.f = f
+        self.size = 0
+
+    def read(self, size=-1):
+        data = self.f.read(size)
+        self.size += len(data)
+        return data
+
+    def readinto(self, b):
+        n = self.f.readinto(b)
+        self.size += n
+        return n
+
+    def readline(self, size=-1):
+        data = self.f.readline(size)
+        self.size += len(data)
+        return data
+
+
+# counts the pickled bytes without keeping them
+class CountingWriter(object):
+    def __init__(self):
+        self.size = 0
+
+    def write(self, data):
+        size = memoryview(data).nbytes
+        self.size += size
+        return size
+
+
+def dump(obj, f, native=False):
+    if native:
+        NativePickler(f, protocol=pickle.HIGHEST_PROTOCOL).dump(obj)
+    else:
+        pickle.dump(obj, f, protocol=pickle.HIGHEST_PROTOCOL)
+
+
+def write_header(f, codec, native=False):
+    serializer = 'native' if native else 'pickle'
+    f.write(MAGIC + ' {} {}\n'.format(codec.name, serializer).encode())
+
+
+def unpickler(f, serializer='pickle'):
+    if serializer == 'native':
+        return NativeUnpickler(f)
+
+    return pickle.Unpickler(f)
+
+
+@contextmanager
+def open_reader(f):
+    head = f.peek(len(MAGIC))[:len(MAGIC)]
+
+    # checkpoints written before the header existed
+    if head[:len(GZIP_MAGIC)] == GZIP_MAGIC:
+        with GzipCodec().reader(f) as r:
+            yield r, 'pickle'
+        return
+
+    if head != MAGIC:
+        raise CodecError('Unknown checkpoint format')
+
+    _, name, serializer = f.readline().decode().split()
+    with get_codec(name).reader(f) as r:
+        yield r, serializer
+
+
+# returns the object and its uncompressed size
+def load(f):
+    with open_reader(f) as (r, serializer):
+        r = CountingReader(r)
+        return unpickler(r, serializer).load(), r.size
+
+
+def loads(data, serializer='pickle'):
+    return unpickler(io.BytesIO(data), serializer).load()
+
+
+# returns the uncompressed pickle and its serializer
+def decompress(f):
+    with open_reader(f) as (r, serializer):
+        return r.read(), serializer
@@ -0,0 +1,102 @@
+import asyncio
+import logging
+
+logger = logging.getLogger(__name__)
+
+
+def record_time(record):
+    return record.get('timestamp')
+
+
+class Bucket(object):
+    def __init__(self, model_name):
+        self.model_name = model_name
+        self.records = []
+        self.futures = []
+        self.handle = None
+
+
+# collects run_model jobs of one metric and runs them as one batch
+class Coalescer(object):
+    def __init__(self, run_batch, window=0.005, max_batch=64, executor=None):
+        self.run_batch = run_batch
+        self.window = window
+        self.max_batch = max_batch
+        self.executor = executor
+        self.buckets = {}
+        self.locks = {}
+
+    def submit(self, name, model_name, record):
+        loop = asyncio.get_event_loop()
+        future = loop.create_future()
+
+        bucket = self.buckets.get(name)
+        if bucket is None:
+            bucket = Bucket(model_name)
+            bucket.handle = loop.call_later(self.window, self._flush, name)
+            self.buckets[name] = bucket
+
+        bucket.records.append(record)
+        bucket.futures.append(future)
+
+        if len(bucket.records) >= self.max_batch:
+            self._flush(name)
+
+        return future
+
+    def _flush(self, name):
+        bucket = self.buckets.pop(name, None)
+        if bucket is None:
+            return
+
+        bucket.handle.cancel()
+        asyncio.ensure_future(self._run(name, bucket))
+
+    def sort(self, bucket):
+        records = bucket.records
+        futures = bucket.futures
+
+        # 时间戳齐全时按时间顺序训练
+        if any(record_time(record) is None for record in records):
+            return records, futures
+
+        try:
+            order = sorted(range(len(records)),
+                           key=lambda i: record_time(records[i]))
+        except TypeError:
+            return records, futures
+
+        return [records[i] for i in order], [futures[i] for i in order]
+
+    async def _run(self, name, bucket):
+        lock, count = self.locks.get(name, (None, 0))
+        if lock is None:
+            lock = asyncio.Lock()
+
+        self.locks[name] = (lock, count + 1)
+
+        records, futures = self.sort(bucket)
+        loop = asyncio.get_event_loop()
+        try:
+            # batches of one metric run one after another
+            async with lock:
+                results = await loop.run_in_executor(self.executor,
+                                                     self.run_batch, name,
+                                                     bucket.model_name,
+                                                     records)
+        except Exception as e:
+            logger.exception(e)
+            results = [e for _ in records]
+        finally:
+            lock, count = self.locks.pop(name)
+            if count > 1:
+                self.locks[name] = (lock, count - 1)
+
+        for future, result in zip(futures, results):
+            if future.done():
+                continue
+
+            if isinstance(result, Exception):
+                future.set_exception(result)
+            else:
+                future.set_result(result)
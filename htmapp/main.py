@@ -1,12 +1,21 @@
 from aio_periodic import Worker, open_connection
 import os
 import argparse
-from .base_model import BaseModel
-from .app import app, cache
+import asyncio
+import signal
+import logging
+from .app import app, cache, enable_coalesce, enable_actors
+from .checkpoint import CheckPoint, checkpoint_writer
+from .codec import get_codec
+from .store import get_store
+from .utils import parse_size, get_local_nodes
+from .supervisor import Supervisor
+from .prewarm import prewarm
 from concurrent.futures import ThreadPoolExecutor
 
+logger = logging.getLogger(__name__)
+
 worker = Worker()
-worker.blueprint(app)
 
 
 def parse_args(argv):
@@ -39,9 +48,17 @@ def parse_args(argv):
 
     parser.add_argument('--cache-size',
                         dest='cache_size',
-                        default=10,
+                        default=None,
                         type=int,
-                        help='cache size.')
+                        help='cache size. default is 10, or no limit with '
+                        '--cache-memory')
+
+    parser.add_argument('--cache-memory',
+                        dest='cache_memory',
+                        default='0',
+                        type=str,
+                        help='cache memory budget, eg. 8G. default is 0, '
+                        'no limit')
 
     parser.add_argument('--checkpoint',
                         dest='checkpoint',
@@ -49,6 +66,119 @@ def parse_args(argv):
                         type=str,
                         help='CheckPoint Root.')
 
+    parser.add_argument('--store',
+                        dest='store',
+                        default='directory',
+                        choices=['directory', 'packed'],
+                        help='checkpoint store: a directory per metric, or '
+                        'one packed file. default is directory')
+
+    parser.add_argument('--save-workers',
+                        dest='save_workers',
+                        default=2,
+                        type=int,
+                        help='checkpoint writer threads. default is 2')
+
+    parser.add_argument('--save-queue',
+                        dest='save_queue',
+                        default=64,
+                        type=int,
+                        help='max pending checkpoint writes. default is 64')
+
+    parser.add_argument('--codec',
+                        dest='codec',
+                        default='gzip',
+                        type=str,
+                        help='checkpoint codec: raw, gzip[:level], '
+                        'lz4[:level] or zstd[:level]. default is gzip')
+
+    parser.add_argument('--native',
+                        dest='native',
+                        action='store_true',
+                        help='save htm.core objects with their binary format')
+
+    parser.add_argument('--input-log',
+                        dest='input_log',
+                        action='store_true',
+                        help='append training records to a per metric log '
+                        'and replay it on load')
+
+    parser.add_argument('--idle-ttl',
+                        dest='idle_ttl',
+                        default=0,
+                        type=float,
+                        help='save and drop models idle for this many '
+                        'seconds. default is 0, never')
+
+    parser.add_argument('--hibernate-interval',
+                        dest='hibernate_interval',
+                        default=1,
+                        type=float,
+                        help='seconds between hibernate runs. default is 1')
+
+    parser.add_argument('--actors',
+                        dest='actors',
+                        action='store_true',
+                        help='run training jobs on per metric actors '
+                        'instead of the periodicd locker')
+
+    parser.add_argument('--actor-idle',
+                        dest='actor_idle',
+                        default=60,
+                        type=float,
+                        help='seconds before an idle actor is reclaimed. '
+                        'default is 60')
+
+    parser.add_argument('--coalesce-window',
+                        dest='coalesce_window',
+                        default=0,
+                        type=float,
+                        help='milliseconds to collect run_model jobs of one '
+                        'metric into a batch. default is 0, disabled')
+
+    parser.add_argument('--coalesce-max',
+                        dest='coalesce_max',
+                        default=64,
+                        type=int,
+                        help='max run_model jobs in one batch. default is 64')
+
+    parser.add_argument('--prewarm',
+                        dest='prewarm',
+                        default=0,
+                        type=int,
+                        help='load the N most recently saved models at '
+                        'startup. default is 0')
+
+    parser.add_argument('--prewarm-workers',
+                        dest='prewarm_workers',
+                        default=2,
+                        type=int,
+                        help='prewarm decompress processes. default is 2')
+
+    parser.add_argument('--prewarm-timeout',
+                        dest='prewarm_timeout',
+                        default=60,
+                        type=float,
+                        help='stop prewarm after this many seconds. '
+                        'default is 60')
+
+    parser.add_argument('--prewarm-wait',
+                        dest='prewarm_wait',
+                        action='store_true',
+                        help='take jobs only after prewarm finished')
+
+    parser.add_argument('--ready-file',
+                        dest='ready_file',
+                        default='',
+                        type=str,
+                        help='touch this file once the worker is ready')
+
+    parser.add_argument('--processes',
+                        dest='processes',
+                        default=1,
+                        type=int,
+                        help='worker processes. default is 1')
+
     parser.add_argument('enabled_tasks', nargs='*', help='Enabled tasks')
 
     args = parser.parse_args(argv)
@@ -56,11 +186,88 @@ def parse_args(argv):
 
 
 async def main(args):
-    BaseModel.load_models()
+    if args.processes > 1:
+        if args.subfix.find('{}') == -1:
+            args.subfix += '-{}'
+
+        supervisor = Supervisor(serve, args, args.processes)
+        await supervisor.run()
+        return
+
+    await work(args)
+
+
+def serve(args, process_id):
+    os.environ['PROCESS_ID'] = str(process_id)
+    # the supervisor coordinates shutdown with SIGTERM
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+
+    loop = asyncio.new_event_loop()
+    asyncio.set_event_loop(loop)
+    task = loop.create_task(work(args))
+    loop.add_signal_handler(signal.SIGTERM, task.cancel)
+    try:
+        loop.run_until_complete(task)
+    except asyncio.CancelledError:
+        pass
+    finally:
+        cache.save_items()
+        checkpoint_writer.flush()
+        loop.close()
+
 
+async def hibernate(args):
+    loop = asyncio.get_event_loop()
+    while True:
+        await asyncio.sleep(args.hibernate_interval)
+        try:
+            await loop.run_in_executor(None, cache.hibernate, args.idle_ttl)
+        except Exception as e:
+            logger.exception(e)
+
+
+async def warm_up(args):
+    nodes = None
+    node = None
+    if args.processes > 1 and 'PROCESS_ID' in os.environ:
+        # every process shares the checkpoint root, warm only our share
+        nodes = get_local_nodes(args.prefix, args.subfix, args.processes)
+        node = args.prefix + '{}' + args.subfix.format(
+            os.environ['PROCESS_ID'])
+
+    if args.prewarm > 0:
+        try:
+            await asyncio.wait_for(
+                prewarm(cache, args.prewarm, args.prewarm_workers, nodes,
+                        node), args.prewarm_timeout)
+        except asyncio.TimeoutError:
+            logger.warning('Prewarm timeout after {}s'.format(
+                args.prewarm_timeout))
+        except Exception as e:
+            logger.exception(e)
+
+    logger.info('Worker ready')
+    if args.ready_file:
+        with open(args.ready_file, 'w') as f:
+            f.write(str(os.getpid()))
+
+
+async def work(args):
+    cache.memory = parse_size(args.cache_memory)
     cache.size = args.cache_size
+    if cache.size is None:
+        cache.size = 0 if cache.memory > 0 else 10
     cache.checkpoint_root = args.checkpoint
 
+    CheckPoint.store = get_store(args.store, args.checkpoint)
+    CheckPoint.save_codec = get_codec(args.codec)
+    CheckPoint.native = args.native
+    CheckPoint.input_log = args.input_log
+
+    checkpoint_writer.size = args.save_workers
+    checkpoint_writer.max_pending = args.save_queue
+    checkpoint_writer.start()
+
     subfix = args.subfix
     if 'PROCESS_ID' in os.environ:
         if subfix.find('{}') > -1:
@@ -72,5 +279,28 @@ async def main(args):
     executor = ThreadPoolExecutor(args.size * 2)
     worker.set_executor(executor)
 
-    await worker.connect(open_connection, args.periodic_port)
-    await worker.work(args.size)
+    actors = None
+    if args.actors:
+        actors = enable_actors(args.size, args.actor_idle, executor)
+    elif args.coalesce_window > 0:
+        enable_coalesce(args.coalesce_window / 1000, args.coalesce_max,
+                        executor)
+
+    worker.blueprint(app)
+
+    # evicted and idle models are saved here, off the request path
+    cache.background = True
+    hibernate_task = asyncio.ensure_future(hibernate(args))
+
+    warm_up_task = asyncio.ensure_future(warm_up(args))
+    if args.prewarm_wait:
+        await warm_up_task
+
+    try:
+        await worker.connect(open_connection, args.periodic_port)
+        await worker.work(args.size)
+    finally:
+        warm_up_task.cancel()
+        hibernate_task.cancel()
+        if actors:
+            actors.stop()
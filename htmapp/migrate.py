@@ -0,0 +1,85 @@
+from .store import DirectoryStore, PackedStore
+from .wal import InputLog
+import argparse
+import shutil
+import glob
+import os
+import os.path
+from time import time
+
+import logging
+
+logger = logging.getLogger(__name__)
+
+meta_names = ['model_name', 'parameters.json']
+
+
+def parse_args(argv):
+    parser = argparse.ArgumentParser(description='Htmapp checkpoint store.',
+                                     prog=__name__)
+
+    parser.add_argument('--checkpoint',
+                        dest='checkpoint',
+                        default='models',
+                        type=str,
+                        help='CheckPoint Root.')
+
+    parser.add_argument('--remove',
+                        dest='remove',
+                        action='store_true',
+                        help='remove each metric directory once migrated')
+
+    parser.add_argument('action',
+                        choices=['migrate', 'compact'],
+                        help='migrate the directory layout into the packed '
+                        'store, or compact the packed store')
+
+    args = parser.parse_args(argv)
+    return args
+
+
+def migrate_key(src, dst, key):
+    for name in meta_names:
+        value = src.read(key, name)
+        if value is not None:
+            dst.write(key, name, value)
+
+    for path in glob.glob('{}/checkpoint-*'.format(key)):
+        with open(path, 'rb') as f:
+            dst.write_blob(key, os.path.basename(path),
+                           lambda w: shutil.copyfileobj(f, w))
+
+    log = dst.input_log(key)
+    for seq, record in InputLog(os.path.join(key, 'input.log')).replay():
+        log.append(seq, record)
+
+    # the pointer goes last, a half migrated metric has none
+    checkpoint = src.read(key, 'checkpoint')
+    if checkpoint is not None:
+        # keep the save time, prewarm ranks metrics by it
+        mtime = os.stat(os.path.join(key, 'checkpoint')).st_mtime
+        dst.write(key, 'checkpoint', checkpoint.strip(), mtime)
+
+
+def migrate(root, remove=False):
+    src = DirectoryStore()
+    dst = PackedStore(root)
+    start = time()
+    count = 0
+    for key in src.keys(root):
+        migrate_key(src, dst, key)
+        if remove:
+            shutil.rmtree(key)
+
+        count += 1
+        if count % 1000 == 0:
+            logger.info('Migrated {} metrics'.format(count))
+
+    logger.info('Migrated {} metrics in {:.2f}s'.format(count, time() - start))
+
+
+def main(args):
+    if args.action == 'migrate':
+        migrate(args.checkpoint, args.remove)
+
+    PackedStore(args.checkpoint).compact()
@@ -4,11 +4,56 @@ from htm.encoders.rdse import RDSE, RDSE_Parameters
 from htm.encoders.date import DateEncoder
 from htm.bindings.algorithms import SpatialPooler
 from htm.bindings.algorithms import TemporalMemory
+from threading import Lock
 from time import time
+import hashlib
+import json
 
 from ..base_model import BaseModel
 
 
+def buildEncoders(enc):
+    # Make the Encoders.
+    # These will convert input data into binary representations.
+    dateEncoder = DateEncoder(timeOfDay=enc["time"]["timeOfDay"],
+                              weekend=enc["time"]["weekend"])
+
+    scalarEncoderParams = RDSE_Parameters()
+    scalarEncoderParams.size = enc["value"]["size"]
+    scalarEncoderParams.sparsity = enc["value"]["sparsity"]
+    scalarEncoderParams.resolution = enc["value"]["resolution"]
+    scalarEncoder = RDSE(scalarEncoderParams)
+    return dateEncoder, scalarEncoder
+
+
+# encoders only read their parameters while encoding, so models with the
+# same enc block share one pair per process
+class EncoderPool(object):
+    def __init__(self):
+        self.encoders = {}
+        self.lock = Lock()
+
+    def key(self, enc):
+        data = json.dumps(enc, sort_keys=True).encode()
+        return hashlib.sha1(data).hexdigest()
+
+    def get(self, enc):
+        key = self.key(enc)
+        with self.lock:
+            encoders = self.encoders.get(key)
+            if encoders is None:
+                encoders = self.encoders[key] = buildEncoders(enc)
+
+            return encoders
+
+    def clear(self):
+        with self.lock:
+            self.encoders.clear()
+
+
+encoder_pool = EncoderPool()
+
+
 class Model(BaseModel):
     model_name = 'hotgym'
 
@@ -19,23 +64,11 @@ class Model(BaseModel):
 
     def createEncoder(self):
         parameters = self.checkpoint.get_parameters()
-        # Make the Encoders.
-        # These will convert input data into binary representations.
-        dateEncoder = DateEncoder(
-            timeOfDay=parameters["enc"]["time"]["timeOfDay"],
-            weekend=parameters["enc"]["time"]["weekend"])
-
-        scalarEncoderParams = RDSE_Parameters()
-        scalarEncoderParams.size = parameters["enc"]["value"]["size"]
-        scalarEncoderParams.sparsity = parameters["enc"]["value"]["sparsity"]
-        scalarEncoderParams.resolution = parameters["enc"]["value"][
-            "resolution"]
-        scalarEncoder = RDSE(scalarEncoderParams)
-        encodingWidth = (dateEncoder.size + scalarEncoder.size)
+        dateEncoder, scalarEncoder = encoder_pool.get(parameters["enc"])
 
         self.dateEncoder = dateEncoder
         self.scalarEncoder = scalarEncoder
-        self.encodingWidth = encodingWidth
+        self.encodingWidth = dateEncoder.size + scalarEncoder.size
 
     def create(self):
         parameters = self.checkpoint.get_parameters()
@@ -74,10 +107,23 @@ class Model(BaseModel):
 
         self.sp = sp
         self.tm = tm
+        self.createBuffers()
+
+    def createBuffers(self):
+        # reused by every run, the encoders write into them in place
+        self.dateBits = SDR(self.dateEncoder.dimensions)
+        self.consumptionBits = SDR(self.scalarEncoder.dimensions)
+        self.encoding = SDR(self.encodingWidth)
+        self.activeColumns = SDR(self.sp.getColumnDimensions())
+        self.lastTimestamp = None
 
     def prepare(self, model):
         self.createEncoder()
-        return BaseModel.prepare(self, model)
+        if not BaseModel.prepare(self, model):
+            return False
+
+        self.createBuffers()
+        return True
 
     def run(self, timestamp=None, consumption=None):
         if not consumption:
@@ -88,25 +134,23 @@ class Model(BaseModel):
 
         # Call the encoders to create bit representations for each value.
         # These are SDR objects.
-        dateString = datetime.fromtimestamp(timestamp)
-        dateBits = self.dateEncoder.encode(dateString)
-        consumptionBits = self.scalarEncoder.encode(consumption)
+        if timestamp != self.lastTimestamp:
+            self.dateEncoder.encode(datetime.fromtimestamp(timestamp),
+                                    self.dateBits)
+            self.lastTimestamp = timestamp
+
+        self.scalarEncoder.encode(consumption, self.consumptionBits)
 
         # Concatenate all these encodings into one large encoding for
         # Spatial Pooling.
-        encoding = SDR(self.encodingWidth).concatenate(
-            [consumptionBits, dateBits])
-
-        # Create an SDR to represent active columns, This will be populated by
-        # the compute method below. It must have the same dimensions as the
-        # Spatial Pooler.
-        activeColumns = SDR(self.sp.getColumnDimensions())
+        self.encoding.concatenate([self.consumptionBits, self.dateBits])
 
         # Execute Spatial Pooling algorithm over input space.
-        self.sp.compute(encoding, True, activeColumns)
+        # activeColumns has the same dimensions as the Spatial Pooler.
+        self.sp.compute(self.encoding, True, self.activeColumns)
 
         # Execute Temporal Memory algorithm over active mini-columns.
-        self.tm.compute(activeColumns, learn=True)
+        self.tm.compute(self.activeColumns, learn=True)
 
         return {
             'anomaly': self.tm.anomaly,
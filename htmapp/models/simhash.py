@@ -2,6 +2,7 @@ from htm.encoders.simhash_document_encoder import SimHashDocumentEncoder, \
         SimHashDocumentEncoderParameters
 from htm.algorithms import SpatialPooler, Classifier
 from htm.bindings.sdr import SDR
+import numpy as np
 import re
 
 from ..base_model import BaseModel
@@ -63,6 +64,46 @@ class Model(BaseModel):
         self.sp = sp
         self.sdrc = sdrc
         self.targets = []
+        self.target_ids = {}
+
+    def prepare(self, model):
+        if not BaseModel.prepare(self, model):
+            return False
+
+        # targets is the saved list, target_ids only indexes it
+        self.target_ids = {
+            target: i
+            for i, target in enumerate(self.targets)
+        }
+        return True
+
+    def target_id(self, target):
+        i = self.target_ids.get(target)
+        if i is None:
+            i = self.target_ids[target] = len(self.targets)
+            self.targets.append(target)
+
+        return i
+
+    def top_k(self, infer, k=10):
+        n = min(len(self.targets), len(infer))
+        k = min(int(k), n)
+        if k <= 0:
+            return []
+
+        infer = np.asarray(infer[:n], dtype=np.float64)
+        if k < n:
+            # the k-th largest probability, argpartition picks any of its ties
+            kth = -np.partition(-infer, k - 1)[k - 1]
+            above = np.flatnonzero(infer > kth)
+            equal = np.flatnonzero(infer == kth)[:k - len(above)]
+            idx = np.concatenate([above, equal])
+        else:
+            idx = np.arange(n)
+
+        # ties keep the target order, as the full sort did
+        idx = idx[np.argsort(-infer[idx], kind='stable')]
+        return [(self.targets[i], float(infer[i])) for i in idx]
 
     @classmethod
     def is_train(self, *, target=None, **kwargs):
@@ -70,7 +111,24 @@ class Model(BaseModel):
             return True
         return False
 
-    def run(self, source, target=None, only_learn=False):
+    def run(self, source, target=None, only_learn=False, k=10):
+        # Create an SDR to represent active columns, This will be populated by
+        # the compute method below. It must have the same dimensions as the
+        # Spatial Pooler.
+        activeColumns = SDR(self.sp.getColumnDimensions())
+        return self.compute(activeColumns, source, target, only_learn, k)
+
+    def run_batch(self, records):
+        # one active columns SDR for the whole batch, in record order
+        activeColumns = SDR(self.sp.getColumnDimensions())
+        return [self.compute(activeColumns, **record) for record in records]
+
+    def compute(self,
+                activeColumns,
+                source,
+                target=None,
+                only_learn=False,
+                k=10):
         # Call the encoders to create bit representations for each value.
         # These are SDR objects.
         source = re_spec_code.sub(' ', source)
@@ -78,25 +136,15 @@ class Model(BaseModel):
 
         encoding = self.encoder.encode(source)
 
-        # Create an SDR to represent active columns, This will be populated by
-        # the compute method below. It must have the same dimensions as the
-        # Spatial Pooler.
-        activeColumns = SDR(self.sp.getColumnDimensions())
-
         infers = []
         if not only_learn:
             # Execute Spatial Pooling algorithm over input space.
             self.sp.compute(encoding, False, activeColumns)
 
-            infer = self.sdrc.infer(activeColumns)
-            infers = list(zip(self.targets, infer))
-            infers.sort(key=lambda x: x[1], reverse=True)
+            infers = self.top_k(self.sdrc.infer(activeColumns), k)
 
         if target:
-            if target not in self.targets:
-                self.targets.append(target)
-
             self.sp.compute(encoding, True, activeColumns)
-            self.sdrc.learn(activeColumns, self.targets.index(target))
+            self.sdrc.learn(activeColumns, self.target_id(target))
 
-        return {'infers': infers[:10]}
+        return {'infers': infers}
@@ -0,0 +1,92 @@
+from concurrent.futures import ProcessPoolExecutor
+from .checkpoint import CheckPoint, decompress_checkpoint
+from .base_model import BaseModel
+from .codec import loads
+import multiprocessing
+import asyncio
+import os
+import os.path
+from time import time
+import logging
+
+logger = logging.getLogger(__name__)
+
+
+def restore(cache, name, data, serializer, pointer):
+    checkpoint = CheckPoint(os.path.join(cache.checkpoint_root, name))
+    Model = BaseModel.get(checkpoint.get_model_name())
+    if not Model:
+        return None
+
+    def loader():
+        # jobs run during prewarm, skip metrics saved after decompress
+        if not checkpoint.is_current(pointer):
+            return None
+
+        model = Model(name, checkpoint, cache)
+        if model.restore(loads(data, serializer), len(data)):
+            return model
+
+        return None
+
+    return cache.get_or_load(name, loader)
+
+
+async def prewarm(cache, count, size=2, nodes=None, node=None):
+    if cache.size > 0:
+        count = min(count, cache.size)
+
+    # scan enough recent metrics for our share of the ring
+    scan = count
+    if nodes:
+        scan = count * len(nodes.get_nodes())
+
+    loop = asyncio.get_event_loop()
+    keys = await loop.run_in_executor(None, CheckPoint.store.recent,
+                                      cache.checkpoint_root, scan)
+    names = [os.path.relpath(key, cache.checkpoint_root) for key in keys]
+    if nodes:
+        names = [name for name in names if nodes.get_node(name) == node]
+
+    names = names[:count]
+    if not names:
+        return 0
+
+    logger.info('Prewarm {} models'.format(len(names)))
+    start = time()
+    loaded = 0
+
+    # decompress in child processes, unpickle here where the models live
+    pool = ProcessPoolExecutor(size,
+                               mp_context=multiprocessing.get_context('spawn'))
+
+    async def fetch(name):
+        path = os.path.join(cache.checkpoint_root, name)
+        return name, await loop.run_in_executor(pool, decompress_checkpoint,
+                                                path, CheckPoint.store)
+
+    tasks = [asyncio.ensure_future(fetch(name)) for name in names]
+
+    try:
+        for task in asyncio.as_completed(tasks):
+            try:
+                name, raw = await task
+                if raw is None:
+                    continue
+
+                data, serializer, pointer = raw
+                if await loop.run_in_executor(None, restore, cache, name,
+                                              data, serializer, pointer):
+                    loaded += 1
+            except Exception as e:
+                logger.exception(e)
+    finally:
+        for task in tasks:
+            task.cancel()
+
+        pool.shutdown(wait=False)
+
+    logger.info('Prewarm loaded {} models in {:.2f}s'.format(
+        loaded,
+        time() - start))
+    return loaded
@@ -1,7 +1,8 @@
-from .checkpoint import CheckPoint
+from .checkpoint import CheckPoint, checkpoint_writer
 from .cache import Cache
 from .base_model import BaseModel
 from .config import parameters
+from .store import get_store
 import os.path
 import argparse
 import json
@@ -23,6 +24,13 @@ def parse_args(argv):
                         type=str,
                         help='CheckPoint Root.')
 
+    parser.add_argument('--store',
+                        dest='store',
+                        default='directory',
+                        choices=['directory', 'packed'],
+                        help='checkpoint store: a directory per metric, or '
+                        'one packed file. default is directory')
+
     parser.add_argument('-m',
                         '--model',
                         dest='model',
@@ -38,7 +46,7 @@ def parse_args(argv):
 
 
 def main(args):
-    BaseModel.load_models()
+    CheckPoint.store = get_store(args.store, args.checkpoint)
 
     checkpoint = CheckPoint(os.path.join(args.checkpoint, args.metric))
 
@@ -65,4 +73,8 @@ def main(args):
     with Model(args.metric, checkpoint, cache) as model:
         v = model.run(**data)
         print(v)
+
+    with model.lock.read():
         model.save()
+
+    checkpoint_writer.flush()
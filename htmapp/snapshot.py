@@ -0,0 +1,97 @@
+from threading import Lock
+from tempfile import TemporaryFile
+from uuid import uuid4
+import pickle
+import time
+import logging
+
+logger = logging.getLogger(__name__)
+
+
+# a pickled model spooled to a temp file, read or written page by page
+class Snapshot(object):
+    def __init__(self, name, chunk_size):
+        self.id = uuid4().hex
+        self.name = name
+        self.chunk_size = chunk_size
+        self.file = TemporaryFile()
+        self.size = 0
+        self.lock = Lock()
+        self.touch()
+
+    def touch(self):
+        self.timestamp = time.time()
+
+    def dump(self, obj):
+        pickle.dump(obj, self.file, protocol=pickle.HIGHEST_PROTOCOL)
+        self.size = self.file.tell()
+
+    def chunks(self):
+        return (self.size + self.chunk_size - 1) // self.chunk_size
+
+    def read(self, index):
+        self.touch()
+        with self.lock:
+            self.file.seek(index * self.chunk_size)
+            return self.file.read(self.chunk_size)
+
+    def write(self, index, data):
+        self.touch()
+        with self.lock:
+            self.file.seek(index * self.chunk_size)
+            self.file.write(data)
+            self.size = max(self.size, self.file.tell())
+
+    def load(self):
+        with self.lock:
+            self.file.seek(0)
+            return pickle.load(self.file)
+
+    def close(self):
+        self.file.close()
+
+    def info(self):
+        return {
+            'id': self.id,
+            'size': self.size,
+            'chunk_size': self.chunk_size,
+            'chunks': self.chunks(),
+        }
+
+
+class Snapshots(object):
+    def __init__(self, ttl=300):
+        self.ttl = ttl
+        self.snapshots = {}
+        self.lock = Lock()
+
+    def add(self, snapshot):
+        self.expire()
+        with self.lock:
+            self.snapshots[snapshot.id] = snapshot
+
+    def get(self, sid):
+        with self.lock:
+            return self.snapshots.get(sid)
+
+    def remove(self, sid):
+        with self.lock:
+            snapshot = self.snapshots.pop(sid, None)
+
+        if snapshot:
+            snapshot.close()
+
+    def expire(self):
+        now = time.time()
+        with self.lock:
+            expired = [
+                s for s in self.snapshots.values()
+                if s.timestamp + self.ttl < now
+            ]
+            for snapshot in expired:
+                self.snapshots.pop(snapshot.id)
+
+        for snapshot in expired:
+            logger.info('Snapshot {} of {} expired'.format(
+                snapshot.id, snapshot.name))
+            snapshot.close()
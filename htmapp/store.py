@@ -0,0 +1,248 @@
+from threading import local
+from time import time
+from uuid import uuid4
+from .wal import InputLog
+import sqlite3
+import glob
+import json
+import io
+import os
+import os.path
+import logging
+
+logger = logging.getLogger(__name__)
+
+
+def safe_float(v):
+    try:
+        return float(v)
+    except Exception:
+        return 0
+
+
+def generation_time(name):
+    return safe_float(name.split('-')[-1])
+
+
+# one directory per metric, one file per metadata and generation
+class DirectoryStore(object):
+    name = 'directory'
+
+    def ensure(self, key):
+        if not os.path.isdir(key):
+            os.makedirs(key)
+
+    def _tmp_path(self, key, name):
+        # unique per write, concurrent writers of one name must not collide
+        return os.path.join(key, '.{}.{}.tmp'.format(name, uuid4().hex))
+
+    def read(self, key, name):
+        path = os.path.join(key, name)
+        if not os.path.isfile(path):
+            return None
+
+        with open(path, 'r') as f:
+            return f.read()
+
+    def write(self, key, name, value, updated_at=None):
+        tmp_path = self._tmp_path(key, name)
+        with open(tmp_path, 'w') as f:
+            f.write(value)
+
+        if updated_at is not None:
+            os.utime(tmp_path, (updated_at, updated_at))
+
+        os.replace(tmp_path, os.path.join(key, name))
+
+    def write_blob(self, key, name, write):
+        path = os.path.join(key, name)
+        tmp_path = self._tmp_path(key, name)
+        with open(tmp_path, 'wb') as f:
+            write(f)
+            size = f.tell()
+
+        os.replace(tmp_path, path)
+        return size
+
+    def open_blob(self, key, name):
+        path = os.path.join(key, name)
+        if not os.path.isfile(path):
+            return None
+
+        return open(path, 'rb')
+
+    def remove_blobs(self, key, keep=0):
+        files = glob.glob('{}/checkpoint-*'.format(key))
+        files.sort(key=generation_time, reverse=True)
+
+        for file in files[keep:]:
+            if os.path.isfile(file):
+                os.remove(file)
+
+    def input_log(self, key):
+        return InputLog(os.path.join(key, 'input.log'))
+
+    def keys(self, root):
+        if not os.path.isdir(root):
+            return
+
+        with os.scandir(root) as it:
+            for entry in it:
+                if entry.is_dir():
+                    yield entry.path
+
+    def recent(self, root, count):
+        checkpoints = []
+        for key in self.keys(root):
+            try:
+                mtime = os.stat(os.path.join(key, 'checkpoint')).st_mtime
+            except OSError:
+                continue
+
+            checkpoints.append((mtime, key))
+
+        checkpoints.sort(reverse=True)
+        return [key for _, key in checkpoints[:count]]
+
+    def compact(self):
+        pass
+
+
+# every metric in one SQLite file under the checkpoint root
+class PackedStore(object):
+    name = 'packed'
+
+    def __init__(self, root, filename='checkpoints.db'):
+        self.root = root
+        self.path = os.path.join(root, filename)
+        self.local = local()
+
+    def __getstate__(self):
+        return {'root': self.root, 'path': self.path}
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        self.local = local()
+
+    @property
+    def db(self):
+        db = getattr(self.local, 'db', None)
+        if db is None:
+            if not os.path.isdir(self.root):
+                os.makedirs(self.root)
+
+            db = sqlite3.connect(self.path, timeout=60, isolation_level=None)
+            db.execute('PRAGMA auto_vacuum=INCREMENTAL')
+            db.execute('PRAGMA journal_mode=WAL')
+            db.execute('PRAGMA synchronous=NORMAL')
+            db.execute('CREATE TABLE IF NOT EXISTS meta (key TEXT, '
+                       'name TEXT, value TEXT, updated_at REAL, '
+                       'PRIMARY KEY (key, name))')
+            db.execute('CREATE TABLE IF NOT EXISTS blobs (key TEXT, '
+                       'name TEXT, data BLOB, PRIMARY KEY (key, name))')
+            db.execute('CREATE TABLE IF NOT EXISTS logs (key TEXT, '
+                       'seq INTEGER, record TEXT, PRIMARY KEY (key, seq))')
+            self.local.db = db
+
+        return db
+
+    def _key(self, key):
+        return os.path.relpath(key, self.root)
+
+    def ensure(self, key):
+        pass
+
+    def read(self, key, name):
+        row = self.db.execute('SELECT value FROM meta WHERE key=? AND name=?',
+                              (self._key(key), name)).fetchone()
+        if row:
+            return row[0]
+
+        return None
+
+    def write(self, key, name, value, updated_at=None):
+        if updated_at is None:
+            updated_at = time()
+
+        self.db.execute('INSERT OR REPLACE INTO meta VALUES (?, ?, ?, ?)',
+                        (self._key(key), name, value, updated_at))
+
+    def write_blob(self, key, name, write):
+        f = io.BytesIO()
+        write(f)
+        self.db.execute('INSERT OR REPLACE INTO blobs VALUES (?, ?, ?)',
+                        (self._key(key), name, f.getbuffer()))
+        return f.tell()
+
+    def open_blob(self, key, name):
+        row = self.db.execute('SELECT data FROM blobs WHERE key=? AND name=?',
+                              (self._key(key), name)).fetchone()
+        if row is None:
+            return None
+
+        return io.BufferedReader(io.BytesIO(row[0]))
+
+    def remove_blobs(self, key, keep=0):
+        key = self._key(key)
+        names = [
+            row[0] for row in self.db.execute(
+                'SELECT name FROM blobs WHERE key=?', (key, ))
+        ]
+        names.sort(key=generation_time, reverse=True)
+
+        for name in names[keep:]:
+            self.db.execute('DELETE FROM blobs WHERE key=? AND name=?',
+                            (key, name))
+
+    def input_log(self, key):
+        return PackedInputLog(self, self._key(key))
+
+    def keys(self, root):
+        for row in self.db.execute('SELECT DISTINCT key FROM meta'):
+            yield os.path.join(self.root, row[0])
+
+    def recent(self, root, count):
+        rows = self.db.execute(
+            'SELECT key FROM meta WHERE name=? ORDER BY updated_at DESC '
+            'LIMIT ?', ('checkpoint', count))
+        return [os.path.join(self.root, row[0]) for row in rows]
+
+    def compact(self):
+        self.db.execute('DELETE FROM blobs WHERE NOT EXISTS (SELECT 1 FROM '
+                        'meta WHERE meta.key=blobs.key)')
+        self.db.execute('PRAGMA wal_checkpoint(TRUNCATE)')
+        self.db.execute('PRAGMA incremental_vacuum')
+
+
+class PackedInputLog(object):
+    def __init__(self, store, key):
+        self.store = store
+        self.key = key
+
+    def close(self):
+        pass
+
+    def append(self, seq, record):
+        self.store.db.execute('INSERT OR REPLACE INTO logs VALUES (?, ?, ?)',
+                              (self.key, seq, json.dumps(record)))
+
+    def replay(self, after=0):
+        rows = self.store.db.execute(
+            'SELECT seq, record FROM logs WHERE key=? AND seq>? '
+            'ORDER BY seq', (self.key, after))
+        return [(seq, json.loads(record)) for seq, record in rows]
+
+    def truncate(self, upto=None):
+        if upto is None:
+            self.store.db.execute('DELETE FROM logs WHERE key=?',
+                                  (self.key, ))
+        else:
+            self.store.db.execute('DELETE FROM logs WHERE key=? AND seq<=?',
+                                  (self.key, upto))
+
+
+def get_store(name, root):
+    if name == 'packed':
+        return PackedStore(root)
+
+    return DirectoryStore()
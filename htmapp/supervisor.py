@@ -0,0 +1,68 @@
+import asyncio
+import multiprocessing
+from time import time
+import logging
+
+logger = logging.getLogger(__name__)
+
+
+class Supervisor(object):
+    def __init__(self, target, args, processes, restart_delay=1):
+        self.target = target
+        self.args = args
+        self.processes = processes
+        self.restart_delay = restart_delay
+        # spawn, so children do not inherit the parent's event loop
+        self.ctx = multiprocessing.get_context('spawn')
+        self.procs = {}
+        self.started_at = {}
+
+    def start_process(self, process_id):
+        p = self.ctx.Process(target=self.target,
+                             args=(self.args, process_id),
+                             name='htmapp-worker-{}'.format(process_id))
+        p.start()
+        logger.info('Start worker {} pid={}'.format(process_id, p.pid))
+        self.procs[process_id] = p
+        self.started_at[process_id] = time()
+
+    def check(self):
+        for process_id, p in list(self.procs.items()):
+            if p.is_alive():
+                continue
+
+            logger.error('Worker {} pid={} exited with {}'.format(
+                process_id, p.pid, p.exitcode))
+
+            # avoid a tight restart loop on a worker that crashes at startup
+            if self.started_at[process_id] + self.restart_delay > time():
+                continue
+
+            self.start_process(process_id)
+
+    def stop(self, timeout=60):
+        for p in self.procs.values():
+            if p.is_alive():
+                p.terminate()
+
+        for process_id, p in self.procs.items():
+            p.join(timeout)
+            if p.is_alive():
+                logger.error('Worker {} pid={} not stopped, kill it'.format(
+                    process_id, p.pid))
+                p.kill()
+                p.join()
+
+        self.procs = {}
+
+    async def run(self):
+        for process_id in range(self.processes):
+            self.start_process(process_id)
+
+        loop = asyncio.get_event_loop()
+        try:
+            while True:
+                self.check()
+                await asyncio.sleep(self.restart_delay)
+        finally:
+            await loop.run_in_executor(None, self.stop)
@@ -1,13 +1,17 @@
 from uhashring import HashRing
 
+size_units = {'': 1, 'K': 1 << 10, 'M': 1 << 20, 'G': 1 << 30, 'T': 1 << 40}
+
 
 def get_prefix_subfix(func):
     prefix, subfix = tuple(func.split('run_model'))
     return prefix + '{}' + subfix
 
 
+# only run_model itself names a node, not run_model_batch
 def is_func(k):
-    return k.find('run_model') > -1
+    parts = k.split('run_model')
+    return len(parts) == 2 and not parts[1].startswith('_batch')
 
 
 async def get_nodes(client):
@@ -17,7 +21,20 @@ async def get_nodes(client):
     return hr
 
 
+# the ring of this host's worker processes, see --processes
+def get_local_nodes(prefix, subfix, processes):
+    funcs = [prefix + '{}' + subfix.format(i) for i in range(processes)]
+    hr = HashRing(funcs, hash_fn='ketama')
+    return hr
+
+
 async def get_func_name(client, func, metric):
     hr = await get_nodes(client)
     tpl = hr.get_node(metric)
     return tpl.format(func)
+
+
+def parse_size(size):
+    size = size.strip().upper().rstrip('B')
+    unit = size[-1:] if size[-1:] in size_units else ''
+    return int(float(size[:len(size) - len(unit)]) * size_units[unit])
@@ -0,0 +1,64 @@
+from threading import Lock
+import os
+import json
+import logging
+
+logger = logging.getLogger(__name__)
+
+
+class InputLog(object):
+    def __init__(self, path):
+        self.path = path
+        self.lock = Lock()
+
+    def close(self):
+        pass
+
+    def append(self, seq, record):
+        line = json.dumps([seq, record]) + '\n'
+        with self.lock:
+            # no fd is kept between appends, thousands of metrics log at once
+            fd = os.open(self.path, os.O_WRONLY | os.O_CREAT | os.O_APPEND,
+                         0o644)
+            try:
+                os.write(fd, line.encode('utf-8'))
+            finally:
+                os.close(fd)
+
+    def _read(self):
+        if not os.path.isfile(self.path):
+            return
+
+        with open(self.path, 'r') as f:
+            for line in f:
+                try:
+                    seq, record = json.loads(line)
+                except ValueError:
+                    # a torn line from a crash while appending
+                    logger.warning('Skip broken input log line: {}'.format(
+                        self.path))
+                    continue
+
+                yield seq, record
+
+    def replay(self, after=0):
+        with self.lock:
+            records = [(seq, record) for seq, record in self._read()
+                       if seq > after]
+
+        return records
+
+    def truncate(self, upto=None):
+        with self.lock:
+            if upto is None:
+                if os.path.isfile(self.path):
+                    os.remove(self.path)
+                return
+
+            tmp_path = self.path + '.tmp'
+            with open(tmp_path, 'w') as f:
+                for seq, record in self._read():
+                    if seq > upto:
+                        f.write(json.dumps([seq, record]) + '\n')
+
+            os.replace(tmp_path, self.path)
@@ -0,0 +1,110 @@
+from collections import OrderedDict
+from threading import Condition, Thread
+import asyncio
+import atexit
+import logging
+
+logger = logging.getLogger(__name__)
+
+
+class CheckPointWriter(object):
+    def __init__(self, size=2, max_pending=64):
+        self.size = size
+        self.max_pending = max_pending
+        # checkpoint directory -> (CheckPoint, data), oldest first
+        self.pending = OrderedDict()
+        self.busy = set()
+        self.cond = Condition()
+        self.threads = []
+        self.written = 0
+        self.written_bytes = 0
+
+    def start(self):
+        with self.cond:
+            if self.threads:
+                return
+
+            for i in range(self.size):
+                t = Thread(target=self._run,
+                           name='checkpoint-writer-{}'.format(i),
+                           daemon=True)
+                t.start()
+                self.threads.append(t)
+
+        atexit.register(self.flush)
+
+    def submit(self, checkpoint, data):
+        self.start()
+        key = checkpoint.checkpoint
+        with self.cond:
+            # a newer snapshot of the same metric replaces the queued one
+            while key not in self.pending and \
+                    len(self.pending) >= self.max_pending:
+                self.cond.wait()
+
+            self.pending[key] = (checkpoint, data)
+            self.cond.notify_all()
+
+    def peek(self, key):
+        with self.cond:
+            while key in self.busy:
+                self.cond.wait()
+
+            item = self.pending.get(key)
+            if item:
+                return item[1]
+
+            return None
+
+    def discard(self, key):
+        with self.cond:
+            while key in self.busy:
+                self.cond.wait()
+
+            self.pending.pop(key, None)
+            self.cond.notify_all()
+
+    def _next(self):
+        for key in self.pending:
+            if key not in self.busy:
+                return key
+
+        return None
+
+    def _run(self):
+        while True:
+            with self.cond:
+                key = self._next()
+                while key is None:
+                    self.cond.wait()
+                    key = self._next()
+
+                checkpoint, data = self.pending.pop(key)
+                self.busy.add(key)
+                self.cond.notify_all()
+
+            try:
+                size = checkpoint.write(data)
+                with self.cond:
+                    self.written += 1
+                    self.written_bytes += size
+            except Exception as e:
+                logger.exception(e)
+            finally:
+                with self.cond:
+                    self.busy.discard(key)
+                    self.cond.notify_all()
+
+    def pending_count(self):
+        with self.cond:
+            return len(self.pending) + len(self.busy)
+
+    def flush(self, timeout=None):
+        with self.cond:
+            return self.cond.wait_for(lambda: not self.pending and
+                                      not self.busy,
+                                      timeout=timeout)
+
+    async def drain(self, timeout=None):
+        loop = asyncio.get_event_loop()
+        return await loop.run_in_executor(None, self.flush, timeout)
@@ -14,6 +14,10 @@ async def after_stop(module):
     if cache:
         cache.save_items()
 
+    writer = getattr(module, 'checkpoint_writer', None)
+    if writer:
+        await writer.drain()
+
 
 if __name__ == '__main__':
     formatter = "[%(asctime)s] %(name)s:%(lineno)d %(levelname)s - %(message)s"